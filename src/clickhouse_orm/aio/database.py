@@ -1,7 +1,7 @@
 from __future__ import annotations
+import asyncio
 import datetime
 import logging
-from io import BytesIO
 from math import ceil
 from typing import Optional, AsyncGenerator
 
@@ -9,8 +9,15 @@ import httpx
 import pytz
 
 from clickhouse_orm.models import MODEL, ModelBase
-from clickhouse_orm.utils import parse_tsv, import_submodules
-from clickhouse_orm.database import Database, ServerError, DatabaseException, logger, Page
+from clickhouse_orm.utils import parse_tsv, parse_tsv_head, aiter_tsv_lines, import_submodules
+from clickhouse_orm.database import (
+    Database,
+    ServerError,
+    DatabaseException,
+    logger,
+    Page,
+    COMPRESSION_METHODS,
+)
 
 
 # pylint: disable=C0116
@@ -19,40 +26,72 @@ from clickhouse_orm.database import Database, ServerError, DatabaseException, lo
 class AioDatabase(Database):
     _client_class = httpx.AsyncClient
 
+    # Number of lines read from a select() response before converting them to model instances
+    select_chunk_size = 4096
+
     async def init(self):
         if self._init:
             return
-        self.db_exists = await self._is_existing_database()
+        # These queries don't depend on each other, so they are sent concurrently
+        probes = [self._is_existing_database(), self._get_server_version_and_timezone()]
+        if self._readonly:
+            probes.append(self._is_connection_readonly())
+        results = await self._gather(*probes)
+        self.db_exists, (self.server_version, self.server_timezone) = results[:2]
         if self._readonly:
             if not self.db_exists:
                 raise DatabaseException(
                     "Database does not exist, and cannot be created under readonly connection"
                 )
-            self.connection_readonly = await self._is_connection_readonly()
+            self.connection_readonly = results[2]
             self.readonly = True
         elif self.auto_create and not self.db_exists:
             await self.create_database()
-        self.server_version = await self._get_server_version()
-        if self.server_version > (1, 1, 53981):
-            self.server_timezone = await self._get_server_timezone()
-        else:
-            self.server_timezone = pytz.utc
+        self._update_base_params()
         self.has_codec_support = self.server_version >= (19, 1, 16)
         self.has_low_cardinality_support = self.server_version >= (19, 0)
         self._init = True
 
+    async def _gather(self, *aws):
+        """
+        Awaits the given coroutines concurrently and returns their results. ClickHouse
+        doesn't allow concurrent queries in the same session, so inside a session they
+        are awaited one after the other.
+        """
+        if self.session_id is None:
+            return await asyncio.gather(*aws)
+        return [await aw for aw in aws]
+
+    def _auto_init(self):
+        # The asynchronous init() must be awaited explicitly
+        pass
+
     async def close(self):
         await self.request_session.aclose()
 
     async def _send(
-        self, data: str | bytes | AsyncGenerator, settings: dict = None, stream: bool = False
+        self,
+        data: str | bytes | AsyncGenerator,
+        settings: dict = None,
+        stream: bool = False,
+        allow_get: bool = True,
     ):
-        r = await super()._send(data, settings, stream)
+        r = await super()._send(data, settings, stream, allow_get)
         if r.status_code != 200:
             await r.aread()
             raise ServerError(r.text)
         return r
 
+    async def _aiter_bytes(self, r):
+        factory = COMPRESSION_METHODS.get(r.headers.get("content-encoding"))
+        if factory is None:
+            async for chunk in r.aiter_bytes(self.read_chunk_size):
+                yield chunk
+        else:
+            decompressor = factory()
+            async for chunk in r.aiter_raw(self.read_chunk_size):
+                yield decompressor.decompress(chunk)
+
     async def count(self, model_class: type[MODEL], conditions=None) -> int:
         """
         Counts the number of records in the model's table.
@@ -85,6 +124,7 @@ class AioDatabase(Database):
             % (self.db_name, self.engine.create_database_sql())
         )
         self.db_exists = True
+        self._update_base_params()
 
     async def drop_database(self):
         """
@@ -92,6 +132,7 @@ class AioDatabase(Database):
         """
         await self._send("DROP DATABASE `%s`" % self.db_name)
         self.db_exists = False
+        self._update_base_params()
 
     async def create_table(self, model_class: type[MODEL]) -> None:
         """
@@ -162,19 +203,29 @@ class AioDatabase(Database):
         db_name = "system" if system_table else self.db_name
         sql = "DESCRIBE `%s`.`%s` FORMAT TSV" % (db_name, table_name)
         lines = await self._send(sql)
-        fields = [parse_tsv(line)[:2] async for line in lines.aiter_lines()]
+        fields = [parse_tsv_head(line, 2) async for line in lines.aiter_lines()]
         model = ModelBase.create_ad_hoc_model(fields, table_name)
         if system_table:
             model._system = model._readonly = True
         return model
 
-    async def insert(self, model_instances, batch_size=1000):
+    async def insert(
+        self, model_instances, batch_size=1000, flush_bytes=1024 * 1024, format="TabSeparated"
+    ):
         """
         Insert records into the database.
 
         - `model_instances`: any iterable containing instances of a single model class.
         - `batch_size`: number of records to send per chunk (use a lower number if your records are very large).
+        - `flush_bytes`: size in bytes at which a chunk is sent even if it has fewer than
+                         `batch_size` records (1 MiB by default).
+        - `format`: "TabSeparated" (the default), or "RowBinary" to send the instances in binary
+                    form, which requires the model's fields to match the table's column types
+                    exactly. "auto" is the same as "RowBinary". Models that don't support
+                    RowBinary are always inserted as TabSeparated (or TSKV).
         """
+        if format not in ("auto", "TabSeparated", "RowBinary"):
+            raise ValueError("Invalid insert format: %r" % format)
         i = iter(model_instances)
         try:
             first_instance = next(i)
@@ -186,31 +237,43 @@ class AioDatabase(Database):
             raise DatabaseException("You can't insert into read only and system tables")
 
         fields_list = ",".join(["`%s`" % name for name in first_instance.fields(writable=True)])
-        fmt = "TSKV" if model_class.has_funcs_as_defaults() else "TabSeparated"
-        query = "INSERT INTO $table (%s) FORMAT %s\n" % (fields_list, fmt)
+        to_rowbinary = None
+        if format != "TabSeparated":
+            to_rowbinary = ModelBase.compile_to_rowbinary(model_class)
+        if to_rowbinary:
+            # The query is sent as a parameter, since binary data can't follow it in the body
+            query = "INSERT INTO $table (%s) FORMAT RowBinary" % fields_list
+            settings = {"query": self._substitute(query, model_class)}
+            header = b""
+            to_db_string = to_rowbinary
+        else:
+            fmt = "TSKV" if model_class.has_funcs_as_defaults() else "TabSeparated"
+            query = "INSERT INTO $table (%s) FORMAT %s\n" % (fields_list, fmt)
+            settings = None
+            header = self._substitute(query, model_class).encode("utf-8")
+            to_db_string = ModelBase.compile_to_db_string(model_class)
 
         async def gen():
-            buf = BytesIO()
-            buf.write(self._substitute(query, model_class).encode("utf-8"))
+            buf = bytearray(header)
             first_instance.set_database(self)
-            buf.write(first_instance.to_db_string())
-            # Collect lines in batches of batch_size
+            buf += to_db_string(first_instance)
+            # Collect lines in batches of batch_size, or of flush_bytes at most
             lines = 2
             for instance in i:
                 instance.set_database(self)
-                buf.write(instance.to_db_string())
+                buf += to_db_string(instance)
                 lines += 1
-                if lines >= batch_size:
+                if lines >= batch_size or len(buf) >= flush_bytes:
                     # Return the current batch of lines
-                    yield buf.getvalue()
-                    # Start a new batch
-                    buf = BytesIO()
+                    yield bytes(buf)
+                    # Start a new batch, reusing the buffer
+                    buf.clear()
                     lines = 0
             # Return any remaining lines in partial batch
             if lines:
-                yield buf.getvalue()
+                yield bytes(buf)
 
-        await self._send(gen())
+        await self._send(gen(), settings)
 
     async def select(
         self, query: str, model_class: Optional[type[MODEL]] = None, settings: Optional[dict] = None
@@ -223,22 +286,37 @@ class AioDatabase(Database):
           or `None` for getting back instances of an ad-hoc model.
         - `settings`: query settings to send as HTTP GET parameters
         """
-        query += " FORMAT TabSeparatedWithNamesAndTypes"
+        skip_blank_lines = self._has_blank_lines(query, settings)
+        # Field types are only needed for creating an ad-hoc model
+        if model_class:
+            query += " FORMAT TabSeparatedWithNames"
+        else:
+            query += " FORMAT TabSeparatedWithNamesAndTypes"
         query = self._substitute(query, model_class)
         r = await self._send(query, settings, True)
         try:
-            field_names, field_types = None, None
-            async for line in r.aiter_lines():
-                # skip blank line left by WITH TOTALS modifier
+            field_names = None
+            lines = []
+            async for line in aiter_tsv_lines(self._aiter_bytes(r)):
                 if not field_names:
                     field_names = parse_tsv(line)
-                elif not field_types:
+                elif not model_class:
                     field_types = parse_tsv(line)
-                    model_class = model_class or ModelBase.create_ad_hoc_model(
-                        zip(field_names, field_types)
-                    )
-                elif line.strip():
-                    yield model_class.from_tsv(line, field_names, self.server_timezone, self)
+                    model_class = ModelBase.create_ad_hoc_model(zip(field_names, field_types))
+                # skip blank lines left by WITH TOTALS modifier or extremes setting
+                elif not skip_blank_lines or line.strip():
+                    lines.append(line)
+                    if len(lines) >= self.select_chunk_size:
+                        for obj in model_class.from_tsv_batch(
+                            lines, field_names, self.server_timezone, self
+                        ):
+                            yield obj
+                        lines = []
+            if lines:
+                for obj in model_class.from_tsv_batch(
+                    lines, field_names, self.server_timezone, self
+                ):
+                    yield obj
         except StopIteration:
             return
         finally:
@@ -253,7 +331,13 @@ class AioDatabase(Database):
         - `stream`: if true, the HTTP response from ClickHouse will be streamed.
         """
         query = self._substitute(query, None)
-        return (await self._send(query, settings=settings, stream=stream)).text
+        r = await self._send(query, settings=settings, stream=stream)
+        if not stream:
+            return r.text
+        try:
+            return b"".join([chunk async for chunk in self._aiter_bytes(r)]).decode("utf-8")
+        finally:
+            await r.aclose()
 
     async def paginate(
         self,
@@ -263,6 +347,7 @@ class AioDatabase(Database):
         page_size: int = 100,
         conditions=None,
         settings: Optional[dict] = None,
+        single_query: bool = False,
     ):
         """
         Selects records and returns a single page of model instances.
@@ -274,29 +359,53 @@ class AioDatabase(Database):
         - `page_size`: number of records to return per page.
         - `conditions`: optional SQL conditions (contents of the WHERE clause).
         - `settings`: query settings to send as HTTP GET parameters
+        - `single_query`: if true, the total number of records is counted by the same query,
+          using a window function (requires ClickHouse v21.9 or above). This saves a round trip,
+          but makes the server read every matching record, so it's only worthwhile when the
+          conditions are selective.
 
         The result is a namedtuple containing `objects` (list), `number_of_objects`,
         `pages_total`, `number` (of the current page), and `page_size`.
         """
         from clickhouse_orm.query import Q
 
-        count = await self.count(model_class, conditions)
-        pages_total = int(ceil(count / float(page_size)))
-        if page_num == -1:
-            page_num = max(pages_total, 1)
-        elif page_num < 1:
+        if not self._init:
+            raise DatabaseException(
+                "The AioDatabase object must execute the init method before it can be used"
+            )
+
+        if page_num < 1 and page_num != -1:
             raise ValueError("Invalid page number: %d" % page_num)
-        offset = (page_num - 1) * page_size
-        query = "SELECT * FROM $table"
-        if conditions:
-            if isinstance(conditions, Q):
-                conditions = conditions.to_sql(model_class)
-            query += " WHERE " + str(conditions)
-        query += " ORDER BY %s" % order_by
-        query += " LIMIT %d, %d" % (offset, page_size)
-        query = self._substitute(query, model_class)
+        if isinstance(conditions, Q):
+            conditions = conditions.to_sql(model_class)
+        where = " WHERE " + str(conditions) if conditions else ""
+        if single_query and page_num != -1 and self.server_version >= (21, 9):
+            offset = (page_num - 1) * page_size
+            query = "SELECT *, count() OVER () AS _total FROM $table%s ORDER BY %s LIMIT %d, %d"
+            query = self._substitute(query % (where, order_by, offset, page_size), model_class)
+            objects, count = await self._select_with_total(query, model_class, settings)
+            if offset and not objects:
+                count = await self.count(model_class, conditions)
+            pages_total = int(ceil(count / float(page_size)))
+        else:
+            query = "SELECT * FROM $table%s ORDER BY %s LIMIT %d, %d"
+            if page_num == -1:
+                # The offset of the last page depends on the count
+                count = await self.count(model_class, conditions)
+                page_num = max(int(ceil(count / float(page_size))), 1)
+                offset = (page_num - 1) * page_size
+                query = self._substitute(query % (where, order_by, offset, page_size), model_class)
+                objects = await self._select_list(query, model_class, settings) if count else []
+            else:
+                offset = (page_num - 1) * page_size
+                query = self._substitute(query % (where, order_by, offset, page_size), model_class)
+                count, objects = await self._gather(
+                    self.count(model_class, conditions),
+                    self._select_list(query, model_class, settings),
+                )
+            pages_total = int(ceil(count / float(page_size)))
         return Page(
-            objects=[r async for r in self.select(query, model_class, settings)] if count else [],
+            objects=objects,
             number_of_objects=count,
             pages_total=pages_total,
             number=page_num,
@@ -317,21 +426,47 @@ class AioDatabase(Database):
         applied_migrations = await self._get_applied_migrations(migrations_package_name)
         modules = import_submodules(migrations_package_name)
         unapplied_migrations = set(modules.keys()) - applied_migrations
-        for name in sorted(unapplied_migrations):
-            logger.info("Applying migration %s...", name)
-            for operation in modules[name].operations:
-                operation.apply(self)
-            await self.insert(
-                [
+        # Record applied migrations with a single insert. This is done even if a migration
+        # fails, so that the ones applied before it are not applied again on the next run.
+        history = []
+        try:
+            for name in sorted(unapplied_migrations):
+                logger.info("Applying migration %s...", name)
+                for operation in modules[name].operations:
+                    operation.apply(self)
+                history.append(
                     MigrationHistory(
                         package_name=migrations_package_name,
                         module_name=name,
                         applied=datetime.date.today(),
                     )
-                ]
-            )
-            if int(name[:4]) >= up_to:
-                break
+                )
+                if int(name[:4]) >= up_to:
+                    break
+        finally:
+            await self.insert(history)
+
+    async def _select_list(self, query, model_class, settings=None):
+        return [r async for r in self.select(query, model_class, settings)]
+
+    async def _select_with_total(self, query, model_class, settings=None):
+        query += " FORMAT TabSeparatedWithNames"
+        r = await self._send(query, settings, True)
+        field_names, rows, total = None, [], 0
+        try:
+            async for line in aiter_tsv_lines(self._aiter_bytes(r)):
+                if field_names is None:
+                    # Skip the trailing _total column
+                    field_names = parse_tsv(line)[:-1]
+                else:
+                    line, _, total = line.rpartition("\t")
+                    rows.append(line)
+        finally:
+            await r.aclose()
+        if not rows:
+            return [], 0
+        objects = model_class.from_tsv_batch(rows, field_names, self.server_timezone, self)
+        return list(objects), int(total)
 
     async def _is_existing_database(self):
         r = await self._send(
@@ -340,7 +475,9 @@ class AioDatabase(Database):
         return r.text.strip() == "1"
 
     async def _is_connection_readonly(self):
-        r = await self._send("SELECT value FROM system.settings WHERE name = 'readonly'")
+        r = await self._send(
+            "SELECT value FROM system.settings WHERE name = 'readonly'", allow_get=False
+        )
         return r.text.strip() != "0"
 
     async def _get_server_timezone(self):
@@ -351,6 +488,14 @@ class AioDatabase(Database):
             logger.exception("Cannot determine server timezone (%s), assuming UTC", err)
             return pytz.utc
 
+    async def _get_server_version_and_timezone(self):
+        try:
+            r = await self._send("SELECT version(), timezone()")
+            ver, timezone = r.text.strip().split("\t")
+        except ServerError:
+            return await self._get_server_version(), pytz.utc
+        return tuple(int(n) for n in ver.split(".") if n.isdigit()), pytz.timezone(timezone)
+
     async def _get_server_version(self, as_tuple=True):
         try:
             r = await self._send("SELECT version();")
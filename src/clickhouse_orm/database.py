@@ -2,8 +2,9 @@ from __future__ import unicode_literals, annotations
 import re
 import logging
 import datetime
-from io import BytesIO
+import threading
 from math import ceil
+from functools import lru_cache
 from string import Template
 from collections import namedtuple
 from typing import Optional, Generator, Union, Any
@@ -13,13 +14,64 @@ import httpx
 
 from .engines import DatabaseEngine, Atomic
 from .models import ModelBase, MODEL
-from .utils import parse_tsv, import_submodules
+from .utils import parse_tsv, parse_tsv_head, iter_tsv_lines, import_submodules
 from .session import ctx_session_id, ctx_session_timeout
 
 
 logger = logging.getLogger("clickhouse_orm")
 Page = namedtuple("Page", "objects number_of_objects pages_total number page_size")
 
+# Matches the beginning of all known error formats, up to the message itself:
+#   ClickHouse v21+:               Code: 60. DB::Exception: <msg>
+#   ClickHouse v19.3.3+:           Code: 60, e.displayText() = DB::Exception: <msg>
+#   ClickHouse prior to v19.3.3:   Code: 60, e.displayText() = DB::Exception: <msg>, e.what() = ...
+ERROR_PATTERN = re.compile(
+    r"""
+    Code:\ (?P<code>\d+)[,.]\s+
+    (?:e\.displayText\(\)\ =\ )?
+    (?P<type1>[^ \n]+):[ ]
+""",
+    re.VERBOSE,
+)
+
+# Queries with the WITH TOTALS modifier or the extremes setting return a blank line
+# before the totals or extremes rows
+BLANK_LINES_PATTERN = re.compile(r"\bWITH\s+TOTALS\b|\bextremes\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def _substitute_cached(query, db_ref, table_ref):
+    """
+    Replaces $db and $table placeholders in the query, given the quoted references.
+    The same queries are substituted over and over, so the results are cached.
+    """
+    mapping = {"db": db_ref}
+    if table_ref is not None:
+        mapping["table"] = table_ref
+    return Template(query).safe_substitute(mapping)
+
+
+def _lz4_decompressor():
+    import lz4.frame  # pylint: disable=C0415
+
+    return lz4.frame.LZ4FrameDecompressor()
+
+
+def _zstd_decompressor():
+    import zstandard  # pylint: disable=C0415
+
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+# Response compression methods that can be requested from ClickHouse. The ones mapped to
+# a decompressor factory aren't decoded by httpx, and require the lz4 or zstandard package.
+COMPRESSION_METHODS = {
+    "gzip": None,
+    "deflate": None,
+    "lz4": _lz4_decompressor,
+    "zstd": _zstd_decompressor,
+}
+
 
 class DatabaseException(Exception):
     """
@@ -43,34 +95,6 @@ class ServerError(DatabaseException):
             self.message = message
             super().__init__(message)
 
-    ERROR_PATTERNS = (
-        # ClickHouse prior to v19.3.3
-        re.compile(
-            r"""
-            Code:\ (?P<code>\d+),
-            \ e\.displayText\(\)\ =\ (?P<type1>[^ \n]+):\ (?P<msg>.+?),
-            \ e.what\(\)\ =\ (?P<type2>[^ \n]+)
-        """,
-            re.VERBOSE | re.DOTALL,
-        ),
-        # ClickHouse v19.3.3+
-        re.compile(
-            r"""
-            Code:\ (?P<code>\d+),
-            \ e\.displayText\(\)\ =\ (?P<type1>[^ \n]+):\ (?P<msg>.+)
-        """,
-            re.VERBOSE | re.DOTALL,
-        ),
-        # ClickHouse v21+
-        re.compile(
-            r"""
-            Code:\ (?P<code>\d+).
-            \ (?P<type1>[^ \n]+):\ (?P<msg>.+)
-        """,
-            re.VERBOSE | re.DOTALL,
-        ),
-    )
-
     @classmethod
     def get_error_code_msg(cls, full_error_message):
         """
@@ -79,11 +103,16 @@ class ServerError(DatabaseException):
         See the list of error codes here:
         https://github.com/yandex/ClickHouse/blob/master/dbms/src/Common/ErrorCodes.cpp
         """
-        for pattern in cls.ERROR_PATTERNS:
-            match = pattern.match(full_error_message)
+        # Error responses may contain long stack traces, so the pattern only parses the
+        # beginning of the message, and the rest is handled with string methods
+        if full_error_message.startswith("Code:"):
+            match = ERROR_PATTERN.match(full_error_message)
             if match:
-                # assert match.group('type1') == match.group('type2')
-                return int(match.group("code")), match.group("msg").strip()
+                msg = full_error_message[match.end() :]
+                end = msg.find(", e.what")
+                if end != -1:
+                    msg = msg[:end]
+                return int(match.group("code")), msg.strip()
 
         return 0, full_error_message
 
@@ -92,6 +121,56 @@ class ServerError(DatabaseException):
             return "{} ({})".format(self.message, self.code)
 
 
+class ServerAttribute:
+    """
+    A `Database` attribute whose value comes from the server, such as its version.
+    Reading it initializes the database connection on first use (see `Database.init`).
+    """
+
+    def __set_name__(self, owner, name):
+        self.attr = "_" + name
+
+    def __get__(self, db, owner=None):
+        if db is None:
+            return self
+        if not db._init:
+            db._auto_init()
+        return getattr(db, self.attr)
+
+    def __set__(self, db, value):
+        setattr(db, self.attr, value)
+
+
+class _Settings(dict):
+    """
+    The settings sent with every request. The database's prebuilt request parameters are
+    updated whenever the settings change, also when they're edited directly.
+    """
+
+    def __init__(self, on_change, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._on_change = on_change
+
+    def _changed(method):  # pylint: disable=E0213
+        def wrapper(self, *args, **kwargs):
+            result = method(self, *args, **kwargs)
+            self._on_change()
+            return result
+
+        wrapper.__name__ = method.__name__
+        return wrapper
+
+    __setitem__ = _changed(dict.__setitem__)
+    __delitem__ = _changed(dict.__delitem__)
+    __ior__ = _changed(dict.__ior__)
+    update = _changed(dict.update)
+    pop = _changed(dict.pop)
+    popitem = _changed(dict.popitem)
+    setdefault = _changed(dict.setdefault)
+    clear = _changed(dict.clear)
+    del _changed
+
+
 class Database:
     """
     Database instances connect to a specific ClickHouse database for running queries,
@@ -100,6 +179,15 @@ class Database:
 
     _client_class = httpx.Client
 
+    db_exists = ServerAttribute()
+    server_version = ServerAttribute()
+    server_timezone = ServerAttribute()
+    has_codec_support = ServerAttribute()
+    has_low_cardinality_support = ServerAttribute()
+
+    # Number of bytes to read at a time from streamed responses
+    read_chunk_size = 64 * 1024
+
     def __init__(
         self,
         db_name,
@@ -112,10 +200,14 @@ class Database:
         verify_ssl_cert=True,
         log_statements=False,
         engine: DatabaseEngine = Atomic(),
+        pool_limits=64,
+        keepalive_expiry=30.0,
+        compression: Optional[str] = None,
     ):
         """
         Initializes a database instance. Unless it's readonly, the database will be
-        created on the ClickHouse server if it does not already exist.
+        created on the ClickHouse server if it does not already exist. No requests are
+        made until the database is first used.
 
         - `db_name`: name of the database to connect to.
         - `db_url`: URL of the ClickHouse server.
@@ -128,32 +220,83 @@ class Database:
         - `verify_ssl_cert`: whether to verify the server's certificate when connecting via HTTPS.
         - `log_statements`: when True, all database statements are logged.
         - `engine`: By default, ClickHouse uses the Atomic database engine.
-        """
+        - `pool_limits`: maximum number of connections (including idle keep-alive ones)
+                        kept in the connection pool.
+        - `keepalive_expiry`: seconds an idle connection is kept open for reuse.
+        - `compression`: compression method for query results - "gzip", "deflate", "lz4" or
+                        "zstd" (the last two require the lz4 or zstandard package). By default
+                        results are not compressed.
+        """
+        if compression is not None and compression not in COMPRESSION_METHODS:
+            raise ValueError("Unsupported compression method: %s" % compression)
         self.db_name = db_name
+        self._db_ref = "`%s`" % db_name
+        self._table_refs = {}
         self.db_url = db_url
         self.readonly = False
         self._readonly = readonly
         self.auto_create = auto_create
         self.timeout = timeout
         self.engine = engine
-        self.request_session = self._client_class(verify=verify_ssl_cert, timeout=timeout)
+        self.request_session = self._client_class(
+            verify=verify_ssl_cert,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=pool_limits,
+                max_keepalive_connections=pool_limits,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
         if username:
             self.request_session.auth = (username, password or "")
+        self.compression = compression
         self.log_statements = log_statements
-        self.settings = {}
+        self._settings = _Settings(self._update_base_params)
+        # The connection is initialized lazily, see init()
+        self._init = False
+        self._initializing = False
+        self._init_lock = threading.RLock()
         self.db_exists = False  # this is required before running _is_existing_database
         self.connection_readonly = False
         self.server_version = None
         self.server_timezone = None
         self.has_codec_support = None
         self.has_low_cardinality_support = None
-        self._init = False
-        if self._client_class is httpx.Client:
-            self.init()
+        self._update_base_params()
+
+    @property
+    def settings(self) -> dict:
+        """
+        The settings sent with every request, see `add_setting`.
+        """
+        return self._settings
+
+    @settings.setter
+    def settings(self, settings: dict):
+        self._settings = _Settings(self._update_base_params, settings)
+        self._update_base_params()
 
     def init(self):
+        """
+        Checks whether the database exists (creating it if needed) and fetches the server's
+        version and timezone. This happens automatically before the first query is sent,
+        or when any of the attributes that depend on the server is read.
+        """
         if self._init:
             return
+        # Other threads wait until the connection is initialized. The lock is reentrant, so the
+        # queries sent by _init_connection can call init again, which returns at once.
+        with self._init_lock:
+            if self._init or self._initializing:
+                return
+            self._initializing = True
+            try:
+                self._init_connection()
+                self._init = True
+            finally:
+                self._initializing = False
+
+    def _init_connection(self):
         self.db_exists = self._is_existing_database()
         if self._readonly:
             if not self.db_exists:
@@ -164,17 +307,16 @@ class Database:
             self.readonly = True
         elif self.auto_create and not self.db_exists:
             self.create_database()
-        self.server_version = self._get_server_version()
-        # Versions 1.1.53981 and below don't have timezone function
-        if self.server_version > (1, 1, 53981):
-            self.server_timezone = self._get_server_timezone()
-        else:
-            self.server_timezone = pytz.utc
+        self._update_base_params()
+        self.server_version, self.server_timezone = self._get_server_version_and_timezone()
         # Versions 19.1.16 and above support codec compression
         self.has_codec_support = self.server_version >= (19, 1, 16)
         # Version 19.0 and above support LowCardinality
         self.has_low_cardinality_support = self.server_version >= (19, 0)
 
+    def _auto_init(self):
+        self.init()
+
     def create_database(self):
         """
         Creates the database on the ClickHouse server if it does not already exist.
@@ -184,6 +326,7 @@ class Database:
             % (self.db_name, self.engine.create_database_sql())
         )
         self.db_exists = True
+        self._update_base_params()
 
     def drop_database(self):
         """
@@ -191,6 +334,7 @@ class Database:
         """
         self._send("DROP DATABASE `%s`" % self.db_name)
         self.db_exists = False
+        self._update_base_params()
 
     def create_table(self, model_class: type[MODEL]) -> None:
         """
@@ -231,7 +375,7 @@ class Database:
         db_name = "system" if system_table else self.db_name
         sql = "DESCRIBE `%s`.`%s` FORMAT TSV" % (db_name, table_name)
         lines = self._send(sql).iter_lines()
-        fields = [parse_tsv(line)[:2] for line in lines]
+        fields = [parse_tsv_head(line, 2) for line in lines]
         model = ModelBase.create_ad_hoc_model(fields, table_name)
         if system_table:
             model._system = model._readonly = True
@@ -251,14 +395,24 @@ class Database:
         else:
             self.settings[name] = str(value)
 
-    def insert(self, model_instances, batch_size=1000):
+    def insert(
+        self, model_instances, batch_size=1000, flush_bytes=1024 * 1024, format="TabSeparated"
+    ):
         """
         Insert records into the database.
 
         - `model_instances`: any iterable containing instances of a single model class.
         - `batch_size`: number of records to send per chunk
                         (use a lower number if your records are very large).
-        """
+        - `flush_bytes`: size in bytes at which a chunk is sent even if it has fewer than
+                         `batch_size` records (1 MiB by default).
+        - `format`: "TabSeparated" (the default), or "RowBinary" to send the instances in binary
+                    form, which requires the model's fields to match the table's column types
+                    exactly. "auto" is the same as "RowBinary". Models that don't support
+                    RowBinary are always inserted as TabSeparated (or TSKV).
+        """
+        if format not in ("auto", "TabSeparated", "RowBinary"):
+            raise ValueError("Invalid insert format: %r" % format)
         i = iter(model_instances)
         try:
             first_instance = next(i)
@@ -270,31 +424,43 @@ class Database:
             raise DatabaseException("You can't insert into read only and system tables")
 
         fields_list = ",".join(["`%s`" % name for name in first_instance.fields(writable=True)])
-        fmt = "TSKV" if model_class.has_funcs_as_defaults() else "TabSeparated"
-        query = "INSERT INTO $table (%s) FORMAT %s\n" % (fields_list, fmt)
+        to_rowbinary = None
+        if format != "TabSeparated":
+            to_rowbinary = ModelBase.compile_to_rowbinary(model_class)
+        if to_rowbinary:
+            # The query is sent as a parameter, since binary data can't follow it in the body
+            query = "INSERT INTO $table (%s) FORMAT RowBinary" % fields_list
+            settings = {"query": self._substitute(query, model_class)}
+            header = b""
+            to_db_string = to_rowbinary
+        else:
+            fmt = "TSKV" if model_class.has_funcs_as_defaults() else "TabSeparated"
+            query = "INSERT INTO $table (%s) FORMAT %s\n" % (fields_list, fmt)
+            settings = None
+            header = self._substitute(query, model_class).encode("utf-8")
+            to_db_string = ModelBase.compile_to_db_string(model_class)
 
         def gen():
-            buf = BytesIO()
-            buf.write(self._substitute(query, model_class).encode("utf-8"))
+            buf = bytearray(header)
             first_instance.set_database(self)
-            buf.write(first_instance.to_db_string())
-            # Collect lines in batches of batch_size
+            buf += to_db_string(first_instance)
+            # Collect lines in batches of batch_size, or of flush_bytes at most
             lines = 2
             for instance in i:
                 instance.set_database(self)
-                buf.write(instance.to_db_string())
+                buf += to_db_string(instance)
                 lines += 1
-                if lines >= batch_size:
+                if lines >= batch_size or len(buf) >= flush_bytes:
                     # Return the current batch of lines
-                    yield buf.getvalue()
-                    # Start a new batch
-                    buf = BytesIO()
+                    yield bytes(buf)
+                    # Start a new batch, reusing the buffer
+                    buf.clear()
                     lines = 0
             # Return any remaining lines in partial batch
             if lines:
-                yield buf.getvalue()
+                yield bytes(buf)
 
-        self._send(gen())
+        self._send(gen(), settings)
 
     def count(
         self, model_class: Optional[type[MODEL]], conditions: Optional[Union[str, "Q"]] = None
@@ -327,19 +493,24 @@ class Database:
           or `None` for getting back instances of an ad-hoc model.
         - `settings`: query settings to send as HTTP GET parameters
         """
-        query += " FORMAT TabSeparatedWithNamesAndTypes"
+        skip_blank_lines = self._has_blank_lines(query, settings)
+        # Field types are only needed for creating an ad-hoc model
+        if model_class:
+            query += " FORMAT TabSeparatedWithNames"
+        else:
+            query += " FORMAT TabSeparatedWithNamesAndTypes"
         query = self._substitute(query, model_class)
         r = self._send(query, settings, True)
         try:
-            lines = r.iter_lines()
+            lines = iter_tsv_lines(self._iter_bytes(r))
             field_names = parse_tsv(next(lines))
-            field_types = parse_tsv(next(lines))
             if not model_class:
+                field_types = parse_tsv(next(lines))
                 model_class = ModelBase.create_ad_hoc_model(zip(field_names, field_types))
-            for line in lines:
-                # skip blank line left by WITH TOTALS modifier
-                if line.strip():
-                    yield model_class.from_tsv(line, field_names, self.server_timezone, self)
+            if skip_blank_lines:
+                # skip blank lines left by WITH TOTALS modifier or extremes setting
+                lines = (line for line in lines if line.strip())
+            yield from model_class.from_tsv_batch(lines, field_names, self.server_timezone, self)
         except StopIteration:
             return
         finally:
@@ -354,7 +525,13 @@ class Database:
         - `stream`: if true, the HTTP response from ClickHouse will be streamed.
         """
         query = self._substitute(query, None)
-        return self._send(query, settings=settings, stream=stream).text
+        r = self._send(query, settings=settings, stream=stream)
+        if not stream:
+            return r.text
+        try:
+            return b"".join(self._iter_bytes(r)).decode("utf-8")
+        finally:
+            r.close()
 
     def paginate(
         self,
@@ -364,6 +541,7 @@ class Database:
         page_size: int = 100,
         conditions=None,
         settings: Optional[dict] = None,
+        single_query: bool = False,
     ):
         """
         Selects records and returns a single page of model instances.
@@ -375,29 +553,43 @@ class Database:
         - `page_size`: number of records to return per page.
         - `conditions`: optional SQL conditions (contents of the WHERE clause).
         - `settings`: query settings to send as HTTP GET parameters
+        - `single_query`: if true, the total number of records is counted by the same query,
+          using a window function (requires ClickHouse v21.9 or above). This saves a round trip,
+          but makes the server read every matching record, so it's only worthwhile when the
+          conditions are selective.
 
         The result is a namedtuple containing `objects` (list), `number_of_objects`,
         `pages_total`, `number` (of the current page), and `page_size`.
         """
         from clickhouse_orm.query import Q
 
-        count = self.count(model_class, conditions)
-        pages_total = int(ceil(count / float(page_size)))
-        if page_num == -1:
-            page_num = max(pages_total, 1)
-        elif page_num < 1:
+        if page_num < 1 and page_num != -1:
             raise ValueError("Invalid page number: %d" % page_num)
-        offset = (page_num - 1) * page_size
-        query = "SELECT * FROM $table"
-        if conditions:
-            if isinstance(conditions, Q):
-                conditions = conditions.to_sql(model_class)
-            query += " WHERE " + str(conditions)
-        query += " ORDER BY %s" % order_by
-        query += " LIMIT %d, %d" % (offset, page_size)
-        query = self._substitute(query, model_class)
+        if isinstance(conditions, Q):
+            conditions = conditions.to_sql(model_class)
+        where = " WHERE " + str(conditions) if conditions else ""
+        if single_query and page_num != -1 and self.server_version >= (21, 9):
+            # Window functions (stable since v21.9) let the server count all matching
+            # records while selecting the page, so no separate count query is needed
+            offset = (page_num - 1) * page_size
+            query = "SELECT *, count() OVER () AS _total FROM $table%s ORDER BY %s LIMIT %d, %d"
+            query = self._substitute(query % (where, order_by, offset, page_size), model_class)
+            objects, count = self._select_with_total(query, model_class, settings)
+            if offset and not objects:
+                # The page is past the last record, so its rows can't tell the total
+                count = self.count(model_class, conditions)
+            pages_total = int(ceil(count / float(page_size)))
+        else:
+            count = self.count(model_class, conditions)
+            pages_total = int(ceil(count / float(page_size)))
+            if page_num == -1:
+                page_num = max(pages_total, 1)
+            offset = (page_num - 1) * page_size
+            query = "SELECT * FROM $table%s ORDER BY %s LIMIT %d, %d"
+            query = self._substitute(query % (where, order_by, offset, page_size), model_class)
+            objects = list(self.select(query, model_class, settings)) if count else []
         return Page(
-            objects=list(self.select(query, model_class, settings)) if count else [],
+            objects=objects,
             number_of_objects=count,
             pages_total=pages_total,
             number=page_num,
@@ -418,21 +610,25 @@ class Database:
         applied_migrations = self._get_applied_migrations(migrations_package_name)
         modules = import_submodules(migrations_package_name)
         unapplied_migrations = set(modules.keys()) - applied_migrations
-        for name in sorted(unapplied_migrations):
-            logger.info("Applying migration %s...", name)
-            for operation in modules[name].operations:
-                operation.apply(self)
-            self.insert(
-                [
+        # Record applied migrations with a single insert. This is done even if a migration
+        # fails, so that the ones applied before it are not applied again on the next run.
+        history = []
+        try:
+            for name in sorted(unapplied_migrations):
+                logger.info("Applying migration %s...", name)
+                for operation in modules[name].operations:
+                    operation.apply(self)
+                history.append(
                     MigrationHistory(
                         package_name=migrations_package_name,
                         module_name=name,
                         applied=datetime.date.today(),
                     )
-                ]
-            )
-            if int(name[:4]) >= up_to:
-                break
+                )
+                if int(name[:4]) >= up_to:
+                    break
+        finally:
+            self.insert(history)
 
     @property
     def session_id(self):
@@ -455,48 +651,163 @@ class Database:
         query = self._substitute(query, MigrationHistory)
         return set(obj.module_name for obj in self.select(query))
 
-    def _send(self, data: str | bytes | Generator, settings: dict = None, stream: bool = False):
+    def _select_with_total(self, query, model_class, settings=None):
+        """
+        Performs a query whose last column is a `_total` count, and returns a list of
+        model instances built from the other columns, along with the total (0 if no rows).
+        """
+        query += " FORMAT TabSeparatedWithNames"
+        r = self._send(query, settings, True)
+        rows, total = [], 0
+        try:
+            lines = iter_tsv_lines(self._iter_bytes(r))
+            # Skip the trailing _total column
+            field_names = parse_tsv(next(lines))[:-1]
+            for line in lines:
+                line, _, total = line.rpartition("\t")
+                rows.append(line)
+        except StopIteration:
+            return [], 0
+        finally:
+            r.close()
+        if not rows:
+            return [], 0
+        objects = model_class.from_tsv_batch(rows, field_names, self.server_timezone, self)
+        return list(objects), int(total)
+
+    def _send(
+        self,
+        data: str | bytes | Generator,
+        settings: dict = None,
+        stream: bool = False,
+        allow_get: bool = True,
+    ):
         if isinstance(data, str):
             data = data.encode("utf-8")
             if self.log_statements:
                 logger.info(data)
         params = self._build_params(settings)
-        request = self.request_session.build_request(
-            method="POST", url=self.db_url, content=data, params=params
+        session = self.request_session
+        headers = session.headers
+        if stream and self.compression:
+            # Results are read as a stream, so they are worth compressing
+            params["enable_http_compression"] = "1"
+            headers = httpx.Headers(headers)
+            headers["Accept-Encoding"] = self.compression
+        method = "POST"
+        if (
+            allow_get
+            and not stream
+            and isinstance(data, bytes)
+            and len(data) < 1024
+            and data.lstrip()[:7].upper() == b"SELECT "
+            and "readonly" not in params
+        ):
+            # Short queries that only read data are sent as a GET request without a body.
+            # ClickHouse runs these with readonly=2, so the readonly setting is left out.
+            method = "GET"
+            params["query"] = data.decode("utf-8")
+            data = None
+        # The request is built directly rather than with build_request(), which would also merge
+        # the client's default params and cookies. The client's current headers, URL and timeout
+        # are read on every call, so changes made to them later are respected.
+        request = httpx.Request(
+            method,
+            self.db_url,
+            content=data,
+            params=params,
+            headers=headers,
+            extensions={"timeout": session.timeout.as_dict()},
         )
-        r = self.request_session.send(request, stream=stream)
+        r = session.send(request, stream=stream)
         if isinstance(r, httpx.Response) and r.status_code != 200:
             r.read()
             raise ServerError(r.text)
         return r
 
+    def _iter_bytes(self, r):
+        """
+        Iterates over the decoded body of a streamed response, in chunks of `read_chunk_size`.
+        """
+        factory = COMPRESSION_METHODS.get(r.headers.get("content-encoding"))
+        if factory is None:
+            yield from r.iter_bytes(self.read_chunk_size)
+        else:
+            decompressor = factory()
+            for chunk in r.iter_raw(self.read_chunk_size):
+                yield decompressor.decompress(chunk)
+
+    def _has_blank_lines(self, query, settings):
+        """
+        Returns True if the query's results may contain blank lines, which ClickHouse writes
+        before the totals row (WITH TOTALS) and before the extremes rows (extremes setting).
+        """
+        if BLANK_LINES_PATTERN.search(query):
+            return True
+        for values in (settings, self.settings):
+            if values and str(values.get("extremes", 0)).lower() not in ("0", "false"):
+                return True
+        return False
+
     def _build_params(self, settings):
-        params = dict(settings or {})
-        params.update(self.settings)
-        params.update(self._context_params)
-        if self.db_exists:
+        if not self._init:
+            self._auto_init()
+        params = {**settings, **self._base_params} if settings else self._base_params.copy()
+        if ctx_session_id.get(None):
+            params.update(self._context_params)
+        return params
+
+    def _update_base_params(self):
+        """
+        Rebuilds the parameters sent with every request. This is done whenever the settings,
+        the existence of the database or the readonly mode change, rather than on every request.
+        """
+        params = dict(self.settings)
+        # Reading _db_exists directly, since db_exists would trigger init while it's in progress
+        if self._db_exists:
             params["database"] = self.db_name
         # Send the readonly flag, unless the connection is already readonly (to prevent db error)
         if self.readonly and not self.connection_readonly:
             params["readonly"] = "1"
-        return params
+        self._base_params = params
 
     def _substitute(self, query, model_class=None):
         """
         Replaces $db and $table placeholders in the query.
         """
         if "$" in query:
-            mapping = dict(db="`%s`" % self.db_name)
+            table_ref = None
             if model_class:
-                if model_class.is_system_model():
-                    mapping["table"] = "`system`.`%s`" % model_class.table_name()
-                elif model_class.is_temporary_model():
-                    mapping["table"] = "`%s`" % model_class.table_name()
-                else:
-                    mapping["table"] = "`%s`.`%s`" % (self.db_name, model_class.table_name())
-            query = Template(query).safe_substitute(mapping)
+                table_ref = self._table_refs.get(model_class) or self._table_ref(model_class)
+            if len(query) <= 4096:
+                query = _substitute_cached(query, self._db_ref, table_ref)
+            else:
+                # Long queries are unlikely to repeat, and would take up memory in the cache
+                query = _substitute_cached.__wrapped__(query, self._db_ref, table_ref)
         return query
 
+    def _table_ref(self, model_class):
+        """
+        Returns the quoted reference to the model's table, which is cached per model class.
+        """
+        if model_class.is_system_model():
+            table_ref = "`system`.`%s`" % model_class.table_name()
+        elif model_class.is_temporary_model():
+            table_ref = "`%s`" % model_class.table_name()
+        else:
+            table_ref = "`%s`.`%s`" % (self.db_name, model_class.table_name())
+        self._table_refs[model_class] = table_ref
+        return table_ref
+
+    def _get_server_version_and_timezone(self):
+        try:
+            r = self._send("SELECT version(), timezone()")
+            ver, timezone = r.text.strip().split("\t")
+        except ServerError:
+            # Versions 1.1.53981 and below don't have timezone function
+            return self._get_server_version(), pytz.utc
+        return tuple(int(n) for n in ver.split(".") if n.isdigit()), pytz.timezone(timezone)
+
     def _get_server_timezone(self):
         try:
             r = self._send("SELECT timezone()")
@@ -519,7 +830,8 @@ class Database:
         return r.text.strip() == "1"
 
     def _is_connection_readonly(self):
-        r = self._send("SELECT value FROM system.settings WHERE name = 'readonly'")
+        # A GET request would be run with readonly=2 regardless of the user's settings
+        r = self._send("SELECT value FROM system.settings WHERE name = 'readonly'", allow_get=False)
         return r.text.strip() != "0"
 
 
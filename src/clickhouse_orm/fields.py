@@ -2,6 +2,7 @@ from __future__ import unicode_literals, annotations
 
 import json
 import re
+import struct
 import datetime
 from enum import Enum
 from uuid import UUID
@@ -26,6 +27,18 @@ if TYPE_CHECKING:
 logger = getLogger("clickhouse_orm")
 
 
+def _rowbinary_length(length: int) -> bytes:
+    """
+    Encodes a length prefix as an unsigned LEB128 varint, as used by the RowBinary format.
+    """
+    out = bytearray()
+    while length > 0x7F:
+        out.append(length & 0x7F | 0x80)
+        length >>= 7
+    out.append(length)
+    return bytes(out)
+
+
 class Field(FunctionOperatorsMixin):
     """
     Abstract base class for all field types.
@@ -115,6 +128,26 @@ class Field(FunctionOperatorsMixin):
         """
         return escape(value, quote)
 
+    def to_rowbinary(self, value) -> bytes:
+        """
+        Returns the field's value encoded in ClickHouse's RowBinary format.
+        Subclasses that support this format should override this.
+        """
+        raise NotImplementedError("%s does not support RowBinary" % self.__class__.__name__)
+
+    def has_rowbinary_support(self) -> bool:
+        """
+        Returns True if the field's values can be written in the RowBinary format. This is not the
+        case for field classes that override to_db_string or db_type without overriding
+        to_rowbinary (or rowbinary_format) as well, since the binary encoding depends on both.
+        """
+        for klass in type(self).__mro__:
+            if "to_rowbinary" in klass.__dict__ or "rowbinary_format" in klass.__dict__:
+                return klass is not Field
+            if "to_db_string" in klass.__dict__ or "db_type" in klass.__dict__:
+                return False
+        return False
+
     def get_sql(self, with_default_expression=True, db=None) -> str:
         """
         Returns an SQL expression describing the field (e.g. for CREATE TABLE).
@@ -180,6 +213,10 @@ class StringField(Field):
             return value.decode("UTF-8")
         raise ValueError("Invalid value for %s: %r" % (self.__class__.__name__, value))
 
+    def to_rowbinary(self, value) -> bytes:
+        value = value.encode("UTF-8")
+        return _rowbinary_length(len(value)) + value
+
 
 class FixedStringField(StringField):
     def __init__(
@@ -207,6 +244,9 @@ class FixedStringField(StringField):
                 f"Value of {len(value)} bytes is too long for FixedStringField({self._length})"
             )
 
+    def to_rowbinary(self, value) -> bytes:
+        return value.encode("UTF-8").ljust(self._length, b"\0")
+
 
 class DateField(Field):
     min_value = datetime.date(1970, 1, 1)
@@ -233,6 +273,9 @@ class DateField(Field):
     def to_db_string(self, value, quote=True) -> str:
         return escape(value.isoformat(), quote)
 
+    def to_rowbinary(self, value) -> bytes:
+        return struct.pack("<H", (value - DateField.min_value).days)
+
 
 class DateTimeField(Field):
     class_default = datetime.datetime.fromtimestamp(0, pytz.utc)
@@ -291,6 +334,15 @@ class DateTimeField(Field):
     def to_db_string(self, value, quote=True) -> str:
         return escape("%010d" % timegm(value.utctimetuple()), quote)
 
+    def to_rowbinary(self, value) -> bytes:
+        timestamp = timegm(value.utctimetuple())
+        if not 0 <= timestamp < 2**32:
+            raise ValueError(
+                "%s value %s can't be written as RowBinary, it is out of the DateTime range"
+                % (self.__class__.__name__, value)
+            )
+        return struct.pack("<I", timestamp)
+
 
 class DateTime64Field(DateTimeField):
     db_type = "DateTime64"
@@ -363,6 +415,8 @@ class BaseIntField(Field):
     Abstract base class for all integer-type fields.
     """
 
+    rowbinary_format: str  # struct format, should be overridden by concrete subclasses
+
     def to_python(self, value, timezone_in_use) -> int:
         try:
             return int(value)
@@ -374,6 +428,9 @@ class BaseIntField(Field):
         # special characters, and never need quoting
         return str(value)
 
+    def to_rowbinary(self, value) -> bytes:
+        return struct.pack(self.rowbinary_format, value)
+
     def validate(self, value):
         self._range_check(value, self.min_value, self.max_value)
 
@@ -382,48 +439,56 @@ class UInt8Field(BaseIntField):
     min_value = 0
     max_value = 2**8 - 1
     db_type = "UInt8"
+    rowbinary_format = "<B"
 
 
 class UInt16Field(BaseIntField):
     min_value = 0
     max_value = 2**16 - 1
     db_type = "UInt16"
+    rowbinary_format = "<H"
 
 
 class UInt32Field(BaseIntField):
     min_value = 0
     max_value = 2**32 - 1
     db_type = "UInt32"
+    rowbinary_format = "<I"
 
 
 class UInt64Field(BaseIntField):
     min_value = 0
     max_value = 2**64 - 1
     db_type = "UInt64"
+    rowbinary_format = "<Q"
 
 
 class Int8Field(BaseIntField):
     min_value = -(2**7)
     max_value = 2**7 - 1
     db_type = "Int8"
+    rowbinary_format = "<b"
 
 
 class Int16Field(BaseIntField):
     min_value = -(2**15)
     max_value = 2**15 - 1
     db_type = "Int16"
+    rowbinary_format = "<h"
 
 
 class Int32Field(BaseIntField):
     min_value = -(2**31)
     max_value = 2**31 - 1
     db_type = "Int32"
+    rowbinary_format = "<i"
 
 
 class Int64Field(BaseIntField):
     min_value = -(2**63)
     max_value = 2**63 - 1
     db_type = "Int64"
+    rowbinary_format = "<q"
 
 
 class BaseFloatField(Field):
@@ -431,6 +496,8 @@ class BaseFloatField(Field):
     Abstract base class for all float-type fields.
     """
 
+    rowbinary_format: str  # struct format, should be overridden by concrete subclasses
+
     def to_python(self, value, timezone_in_use) -> float:
         try:
             return float(value)
@@ -442,13 +509,22 @@ class BaseFloatField(Field):
         # special characters, and never need quoting
         return str(value)
 
+    def to_rowbinary(self, value) -> bytes:
+        try:
+            return struct.pack(self.rowbinary_format, value)
+        except OverflowError:
+            # Too large for Float32, which ClickHouse also stores as infinity when parsing text
+            return struct.pack(self.rowbinary_format, float("inf") if value > 0 else float("-inf"))
+
 
 class Float32Field(BaseFloatField):
     db_type = "Float32"
+    rowbinary_format = "<f"
 
 
 class Float64Field(BaseFloatField):
     db_type = "Float64"
+    rowbinary_format = "<d"
 
 
 class DecimalField(Field):
@@ -8,7 +8,7 @@ from typing import TypeVar, Optional, TYPE_CHECKING, Any
 import pytz
 
 from .fields import Field, StringField
-from .utils import parse_tsv, NO_VALUE, get_subclass_names, arg_to_sql
+from .utils import parse_tsv, unescape, NO_VALUE, get_subclass_names, arg_to_sql
 from .query import QuerySet
 from .funcs import F
 from .engines import Merge, Distributed, Memory
@@ -221,6 +221,69 @@ class ModelBase(type):
         cls.ad_hoc_model_cache[cache_key] = model_class
         return model_class
 
+    @classmethod
+    def compile_to_db_string(cls, model_class):
+        """
+        Returns a function equivalent to `model_class.to_db_string`, generated specifically
+        for the model's writable fields, so that serializing an instance is a single expression
+        rather than a loop over the fields. The function is generated once per model class.
+        Models that use TSKV or customize their serialization get their own `to_db_string`.
+        """
+        compiled = model_class.__dict__.get("_compiled_to_db_string")
+        if compiled:
+            return compiled
+        if (
+            model_class.has_funcs_as_defaults()
+            or model_class.to_db_string is not Model.to_db_string
+            or model_class.to_tsv is not Model.to_tsv
+        ):
+            return model_class.to_db_string
+        namespace = {}
+        parts = []
+        for i, (name, field) in enumerate(model_class.fields(writable=True).items()):
+            namespace["f%d" % i] = field.to_db_string
+            parts.append("f%d(d[%r], False)" % (i, name))
+        source = "def to_db_string(self):\n"
+        source += "    d = self.__dict__\n"
+        source += "    return (%s + '\\n').encode('utf-8')\n" % (" + '\\t' + ".join(parts) or "''")
+        exec(source, namespace)  # pylint: disable=W0122
+        compiled = namespace["to_db_string"]
+        setattr(model_class, "_compiled_to_db_string", compiled)
+        return compiled
+
+    @classmethod
+    def compile_to_rowbinary(cls, model_class):
+        """
+        Like `compile_to_db_string`, but returns a function that encodes an instance in the
+        RowBinary format. Returns None if the model can't be written in this format, because
+        some of its fields don't support it, or because it customizes its TSV serialization.
+        """
+        if "_compiled_to_rowbinary" in model_class.__dict__:
+            return model_class.__dict__["_compiled_to_rowbinary"]
+        fields = model_class.fields(writable=True)
+        if model_class.to_rowbinary is not Model.to_rowbinary:
+            compiled = model_class.to_rowbinary
+        elif (
+            model_class.has_funcs_as_defaults()
+            or model_class.to_db_string is not Model.to_db_string
+            or model_class.to_tsv is not Model.to_tsv
+            or not all(field.has_rowbinary_support() for field in fields.values())
+        ):
+            compiled = None
+        else:
+            namespace = {}
+            parts = []
+            for i, (name, field) in enumerate(fields.items()):
+                namespace["f%d" % i] = field.to_rowbinary
+                parts.append("f%d(d[%r])" % (i, name))
+            source = "def to_rowbinary(self):\n"
+            source += "    d = self.__dict__\n"
+            source += "    return %s\n" % (" + ".join(parts) or "b''")
+            exec(source, namespace)  # pylint: disable=W0122
+            compiled = namespace["to_rowbinary"]
+        setattr(model_class, "_compiled_to_rowbinary", compiled)
+        return compiled
+
     @classmethod
     def create_ad_hoc_field(cls, db_type):
         import clickhouse_orm.fields as orm_fields
@@ -445,6 +508,59 @@ class Model(metaclass=ModelBase):
 
         return obj
 
+    @classmethod
+    def from_tsv_batch(
+        cls, lines, field_names, timezone_in_use=pytz.utc, database=None, chunk_size=4096
+    ):
+        """
+        Create model instances from an iterable of tab-separated lines, yielding them one by one.
+        Lines are processed in chunks, converting the values of each column together, which is
+        considerably faster than calling `from_tsv` for every line.
+
+        - `lines`: an iterable of TSV-formatted lines.
+        - `field_names`: names of the model fields in the data.
+        - `timezone_in_use`: the timezone to use when parsing dates and datetimes. Some fields use their own timezones.
+        - `database`: if given, sets the database that the instances belong to.
+        - `chunk_size`: number of lines to convert at once.
+        """
+        fields = [getattr(cls, name) for name in field_names]
+        timezones = [getattr(field, "timezone", None) or timezone_in_use for field in fields]
+        # Values read from the database were already converted, so unless the model customizes
+        # initialization there's no need to convert and validate them again in __setattr__
+        fast = cls.__init__ is Model.__init__ and cls.__setattr__ is Model.__setattr__
+        count = len(field_names)
+        lines = iter(lines)
+        while True:
+            rows = []
+            for line in lines:
+                if line and line[-1] == "\n":
+                    line = line[:-1]
+                row = line.split("\t")
+                # Columns are converted together, so a malformed row would affect the whole chunk
+                if len(row) != count:
+                    raise ValueError(
+                        "Expected %d values in TSV line, got %d: %r" % (count, len(row), line)
+                    )
+                rows.append(row)
+                if len(rows) >= chunk_size:
+                    break
+            if not rows:
+                return
+            columns = [
+                [field.to_python(unescape(v) if "\\" in v else v, tz) for v in column]
+                for field, tz, column in zip(fields, timezones, zip(*rows))
+            ]
+            for values in zip(*columns):
+                if fast:
+                    obj = cls.__new__(cls)
+                    obj.__dict__.update(cls._defaults)
+                    obj.__dict__.update(zip(field_names, values))
+                else:
+                    obj = cls(**dict(zip(field_names, values)))
+                if database is not None:
+                    obj.set_database(database)
+                yield obj
+
     def to_tsv(self, include_readonly=True):
         """
         Returns the instance's column values as a tab-separated line. A newline is not included.
@@ -480,6 +596,14 @@ class Model(metaclass=ModelBase):
         s += "\n"
         return s.encode("utf-8")
 
+    def to_rowbinary(self) -> bytes:
+        """
+        Returns the instance's writable field values encoded in ClickHouse's RowBinary format.
+        """
+        data = self.__dict__
+        fields = self.fields(writable=True)
+        return b"".join(field.to_rowbinary(data[name]) for name, field in fields.items())
+
     def to_dict(self, include_readonly=True, field_names=None) -> dict[str, Any]:
         """
         Returns the instance's column values as a dict.
@@ -89,6 +89,57 @@ def parse_tsv(line):
     return [unescape(value) for value in line.split(str("\t"))]
 
 
+def parse_tsv_head(line, count):
+    """
+    Parses only the first `count` values of a TSV line, without splitting or unescaping the rest.
+    """
+    if isinstance(line, bytes):
+        line = line.decode()
+    if line and line[-1] == "\n":
+        line = line[:-1]
+    return [unescape(value) for value in line.split("\t", count)[:count]]
+
+
+def _split_tsv_chunk(pending, chunk):
+    """
+    Appends a chunk of bytes to the `pending` bytearray, and returns the decoded lines that
+    are complete. Only the beginning of the next line, if any, is left in `pending`.
+    """
+    end = chunk.rfind(b"\n")
+    if end == -1:
+        pending += chunk
+        return ()
+    pending += memoryview(chunk)[:end]
+    lines = pending.decode("utf-8").split("\n")
+    pending[:] = memoryview(chunk)[end + 1 :]
+    return lines
+
+
+def iter_tsv_lines(chunks):
+    """
+    Splits an iterable of byte chunks (such as an HTTP response body) into decoded lines,
+    without the trailing newline. Each chunk is split and decoded at once, rather than
+    line by line.
+    """
+    pending = bytearray()
+    for chunk in chunks:
+        yield from _split_tsv_chunk(pending, chunk)
+    if pending:
+        yield pending.decode("utf-8")
+
+
+async def aiter_tsv_lines(chunks):
+    """
+    The asynchronous counterpart of `iter_tsv_lines`, for an async iterable of byte chunks.
+    """
+    pending = bytearray()
+    async for chunk in chunks:
+        for line in _split_tsv_chunk(pending, chunk):
+            yield line
+    if pending:
+        yield pending.decode("utf-8")
+
+
 def parse_array(array_string):
     """
     Parse an array or tuple string as returned by clickhouse. For example:
@@ -28,6 +28,27 @@ class DatabaseTestCase(TestCaseWithData):
     def test_insert__medium_batches(self):
         self._insert_and_check(self._sample_data(), len(data), batch_size=100)
 
+    def test_insert__flush_bytes(self):
+        self.database.insert(self._sample_data(), batch_size=10, flush_bytes=64)
+        self.assertEqual(self.database.count(Person), len(data))
+
+    def test_insert__rowbinary(self):
+        class TestModel(Model):
+            a = DateTimeField()
+            b = StringField()
+            c = Int64Field()
+            d = Float32Field()
+            engine = Memory()
+        self.database.create_table(TestModel)
+        instances = [TestModel(a=i * 1000, b="row\t%d\n" % i, c=-i, d=i / 2) for i in range(100)]
+        for fmt in ('RowBinary', 'TabSeparated'):
+            self.database.insert(instances, batch_size=30, format=fmt)
+        results = list(TestModel.objects_in(self.database).order_by('c'))
+        self.assertEqual([r.to_dict() for r in results[::2]], [i.to_dict() for i in reversed(instances)])
+        self.assertEqual([r.to_dict() for r in results[1::2]], [i.to_dict() for i in reversed(instances)])
+        with self.assertRaises(ValueError):
+            self.database.insert(instances, format='CSV')
+
     def test_insert__funcs_as_default_values(self):
         if self.database.server_version < (20, 1, 2, 4):
             raise unittest.SkipTest('Buggy in server versions before 20.1.2.4')
@@ -96,6 +117,14 @@ class DatabaseTestCase(TestCaseWithData):
         self.assertEqual(results[0].get_database(), self.database)
         self.assertEqual(results[1].get_database(), self.database)
 
+    def test_select_empty_rows(self):
+        # Rows that consist of a single empty string are not mistaken for the WITH TOTALS separator
+        results = list(self.database.select("SELECT '' AS s FROM system.numbers LIMIT 3"))
+        self.assertEqual([r.s for r in results], ['', '', ''])
+        query = "SELECT s, count() AS c FROM (SELECT '' AS s FROM system.numbers LIMIT 3) GROUP BY s WITH TOTALS"
+        results = list(self.database.select(query))
+        self.assertEqual([(r.s, r.c) for r in results], [('', 3), ('', 3)])
+
     def test_select_with_totals(self):
         self._insert_and_check(self._sample_data(), len(data))
         query = "SELECT last_name, sum(height) as height FROM `test-db`.person GROUP BY last_name WITH TOTALS"
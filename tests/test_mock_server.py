@@ -0,0 +1,485 @@
+import gzip
+import inspect
+import threading
+import time
+import unittest
+import zlib
+
+import httpx
+
+from clickhouse_orm.database import Database
+from clickhouse_orm.aio.database import AioDatabase
+from clickhouse_orm.models import Model
+from clickhouse_orm.fields import Int32Field, StringField
+from clickhouse_orm.engines import Memory
+
+
+class MockServer:
+    """
+    A minimal stand-in for the ClickHouse HTTP interface, which records the requests it receives.
+    """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def query_of(self, request):
+        body = request.read()
+        query = request.url.params.get("query")
+        return query if query else body.decode("utf-8", "replace")
+
+    def respond(self, query):
+        if "system.databases" in query:
+            return "1\n"
+        if "version()" in query:
+            return "22.3.1.1\tUTC\n"
+        if "system.settings" in query:
+            return "0\n"
+        if "count()" in query:
+            return "2\n"
+        if query.startswith("SELECT") and "FORMAT TabSeparatedWithNames" in query:
+            return "a\tb\n1\tx\n2\ty\n"
+        return ""
+
+    def compress(self, body, method):
+        if method == "gzip":
+            return gzip.compress(body)
+        if method == "deflate":
+            return zlib.compress(body)
+        if method == "lz4":
+            import lz4.frame
+
+            return lz4.frame.compress(body)
+        if method == "zstd":
+            import zstandard
+
+            return zstandard.ZstdCompressor().compress(body)
+        return None
+
+    def handle(self, request):
+        query = self.query_of(request)
+        with self.lock:
+            self.requests.append(request)
+        if self.delay and ("system.databases" in query or "version()" in query):
+            time.sleep(self.delay)
+        body = self.respond(query).encode("utf-8")
+        if request.url.params.get("enable_http_compression") == "1":
+            method = request.headers.get("accept-encoding")
+            compressed = self.compress(body, method)
+            if compressed is not None:
+                headers = {"content-encoding": method}
+                return httpx.Response(200, headers=headers, stream=httpx.ByteStream(compressed))
+        return httpx.Response(200, stream=httpx.ByteStream(body))
+
+    async def handle_async(self, request):
+        await request.aread()
+        return self.handle(request)
+
+    def database(self, db_name="test", **kwargs):
+        handler = self.handle
+
+        class MockDatabase(Database):
+            @staticmethod
+            def _client_class(**client_kwargs):
+                del client_kwargs["verify"]
+                return httpx.Client(transport=httpx.MockTransport(handler), **client_kwargs)
+
+        return MockDatabase(db_name, **kwargs)
+
+    def aio_database(self, db_name="test", **kwargs):
+        handler = self.handle_async
+
+        class MockAioDatabase(AioDatabase):
+            @staticmethod
+            def _client_class(**client_kwargs):
+                del client_kwargs["verify"]
+                return httpx.AsyncClient(transport=httpx.MockTransport(handler), **client_kwargs)
+
+        return MockAioDatabase(db_name, **kwargs)
+
+
+class MockModel(Model):
+
+    a = Int32Field()
+    b = StringField()
+
+    engine = Memory()
+
+
+class BigIdField(Int32Field):
+
+    db_type = "Int64"
+
+
+class BigIdModel(Model):
+
+    a = BigIdField()
+    b = StringField()
+
+    engine = Memory()
+
+
+class LazyInitTestCase(unittest.TestCase):
+
+    def test_init_on_first_query(self):
+        server = MockServer()
+        db = server.database()
+        self.assertEqual(server.requests, [])
+        self.assertEqual([m.a for m in db.select("SELECT * FROM $table", MockModel)], [1, 2])
+        self.assertEqual(db.server_version, (22, 3, 1, 1))
+
+    def test_init_from_several_threads(self):
+        server = MockServer(delay=0.1)
+        db = server.database()
+        results = []
+        errors = []
+
+        def select():
+            try:
+                results.append(list(db.select("SELECT * FROM $table", MockModel)))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=select) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 4)
+        # Every query was sent after the database was initialized, and only once
+        selects = [r for r in server.requests if "FROM `test`.`mockmodel`" in server.query_of(r)]
+        self.assertEqual(len(selects), 4)
+        for request in selects:
+            self.assertEqual(request.url.params.get("database"), "test")
+        probes = [r for r in server.requests if "version()" in server.query_of(r)]
+        self.assertEqual(len(probes), 1)
+
+    def test_init_retried_after_failure(self):
+        server = MockServer()
+        db = server.database()
+        respond = server.respond
+        server.respond = lambda query: 1 / 0 if "system.databases" in query else respond(query)
+        with self.assertRaises(Exception):
+            db.init()
+        server.respond = respond
+        self.assertEqual(db.count(MockModel), 2)
+        self.assertEqual(db.server_version, (22, 3, 1, 1))
+
+
+class SettingsTestCase(unittest.TestCase):
+
+    def _sent_params(self, server, db):
+        db.count(MockModel)
+        return dict(server.requests[-1].url.params)
+
+    def test_settings(self):
+        server = MockServer()
+        db = server.database()
+        db.add_setting("max_threads", 2)
+        self.assertEqual(self._sent_params(server, db).get("max_threads"), "2")
+        db.add_setting("max_threads", None)
+        self.assertNotIn("max_threads", self._sent_params(server, db))
+
+    def test_direct_edits(self):
+        server = MockServer()
+        db = server.database()
+        db.settings["max_threads"] = "2"
+        self.assertEqual(self._sent_params(server, db).get("max_threads"), "2")
+        db.settings.update(max_memory_usage="1000")
+        self.assertEqual(self._sent_params(server, db).get("max_memory_usage"), "1000")
+        del db.settings["max_threads"]
+        self.assertNotIn("max_threads", self._sent_params(server, db))
+        db.settings = {"max_block_size": "10"}
+        params = self._sent_params(server, db)
+        self.assertEqual(params.get("max_block_size"), "10")
+        self.assertNotIn("max_memory_usage", params)
+        db.settings.clear()
+        self.assertNotIn("max_block_size", self._sent_params(server, db))
+        self.assertEqual(params.get("database"), "test")
+
+
+class BlankLinesTestCase(unittest.IsolatedAsyncioTestCase):
+
+    def _server(self):
+        # Results followed by a blank line and rows that aren't part of the data, as returned
+        # for the WITH TOTALS modifier and the extremes setting
+        server = MockServer()
+        respond = server.respond
+
+        def respond_with_blank_lines(query):
+            if "FORMAT TabSeparatedWithNames" in query:
+                return "a\tb\n1\tx\n2\ty\n\n0\t\n\n1\tx\n2\ty\n"
+            return respond(query)
+
+        server.respond = respond_with_blank_lines
+        return server
+
+    async def test_blank_lines_skipped(self):
+        cases = [
+            ("SELECT a, b FROM $table GROUP BY a, b WITH TOTALS", None, {}),
+            ("SELECT a, b FROM $table SETTINGS extremes = 1", None, {}),
+            ("SELECT a, b FROM $table", {"extremes": 1}, {}),
+            ("SELECT a, b FROM $table", None, {"extremes": "1"}),
+        ]
+        for query, settings, db_settings in cases:
+            with self.subTest(query=query, settings=settings, db_settings=db_settings):
+                server = self._server()
+                db = server.database()
+                db.settings.update(db_settings)
+                results = list(db.select(query, MockModel, settings=settings))
+                self.assertEqual([m.a for m in results], [1, 2, 0, 1, 2])
+                db = server.aio_database()
+                db.settings.update(db_settings)
+                await db.init()
+                results = [m async for m in db.select(query, MockModel, settings=settings)]
+                self.assertEqual([m.a for m in results], [1, 2, 0, 1, 2])
+
+    def test_extremes_disabled(self):
+        db = self._server().database()
+        with self.assertRaises(ValueError):
+            list(db.select("SELECT a, b FROM $table", MockModel, settings={"extremes": 0}))
+
+
+class RequestTestCase(unittest.TestCase):
+
+    def test_client_changes(self):
+        server = MockServer()
+        db = server.database(compression="gzip")
+        db.request_session.headers["X-ClickHouse-User"] = "scott"
+        db.request_session.timeout = httpx.Timeout(5)
+        db.db_url = "http://clickhouse:8123/"
+        db.count(MockModel)
+        list(db.select("SELECT * FROM $table", MockModel))
+        for request in server.requests:
+            self.assertEqual(request.headers.get("X-ClickHouse-User"), "scott")
+            self.assertEqual(request.url.host, "clickhouse")
+            self.assertEqual(request.extensions["timeout"]["read"], 5)
+        self.assertEqual(server.requests[-1].headers.get("accept-encoding"), "gzip")
+        # Compression headers aren't added to the client itself
+        self.assertNotEqual(db.request_session.headers.get("accept-encoding"), "gzip")
+
+
+class PaginateTestCase(unittest.IsolatedAsyncioTestCase):
+
+    def _server(self):
+        server = MockServer()
+        respond = server.respond
+
+        def respond_with_total(query):
+            if "count() OVER ()" in query:
+                return "a\tb\t_total\n1\tx\t5\n2\ty\t5\n"
+            return respond(query)
+
+        server.respond = respond_with_total
+        return server
+
+    def _queries(self, server):
+        return [server.query_of(r) for r in server.requests if "mockmodel" in server.query_of(r)]
+
+    async def test_paginate(self):
+        server = self._server()
+        db = server.database()
+        page = db.paginate(MockModel, "a", page_num=1, page_size=2)
+        self.assertEqual(([m.a for m in page.objects], page.number_of_objects), ([1, 2], 2))
+        queries = self._queries(server)
+        self.assertEqual(len(queries), 2)
+        self.assertFalse(any("OVER" in q for q in queries))
+        server = self._server()
+        db = server.aio_database()
+        await db.init()
+        page = await db.paginate(MockModel, "a", page_num=1, page_size=2)
+        self.assertEqual(([m.a for m in page.objects], page.number_of_objects), ([1, 2], 2))
+        self.assertFalse(any("OVER" in q for q in self._queries(server)))
+
+    async def test_paginate_single_query(self):
+        server = self._server()
+        db = server.database()
+        page = db.paginate(MockModel, "a", page_num=1, page_size=2, single_query=True)
+        self.assertEqual([(m.a, m.b) for m in page.objects], [(1, "x"), (2, "y")])
+        self.assertEqual((page.number_of_objects, page.pages_total), (5, 3))
+        [query] = self._queries(server)
+        self.assertIn("count() OVER ()", query)
+        server = self._server()
+        db = server.aio_database()
+        await db.init()
+        page = await db.paginate(MockModel, "a", page_num=1, page_size=2, single_query=True)
+        self.assertEqual([(m.a, m.b) for m in page.objects], [(1, "x"), (2, "y")])
+        self.assertEqual((page.number_of_objects, page.pages_total), (5, 3))
+        self.assertEqual(len(self._queries(server)), 1)
+
+
+class SubstituteTestCase(unittest.TestCase):
+
+    def test_placeholders(self):
+        db = MockServer().database()
+        self.assertEqual(db._substitute("SELECT * FROM $table", MockModel), "SELECT * FROM `test`.`mockmodel`")
+        self.assertEqual(db._substitute("SELECT * FROM ${db}.x", MockModel), "SELECT * FROM `test`.x")
+        self.assertEqual(db._substitute("SELECT * FROM ${table}_x", MockModel), "SELECT * FROM `test`.`mockmodel`_x")
+        # Longer identifiers and escaped dollar signs are left alone, as in string.Template
+        self.assertEqual(db._substitute("SELECT '$table_suffix', '$dbx'", MockModel), "SELECT '$table_suffix', '$dbx'")
+        self.assertEqual(db._substitute("SELECT '$$db', '$x'", MockModel), "SELECT '$db', '$x'")
+        # Without a model class, $table is not substituted
+        self.assertEqual(db._substitute("SELECT * FROM $db.$table"), "SELECT * FROM `test`.$table")
+
+
+class InsertFormatTestCase(unittest.TestCase):
+
+    def _insert(self, instances, **kwargs):
+        server = MockServer()
+        db = server.database()
+        db.init()
+        server.requests.clear()
+        db.insert(instances, **kwargs)
+        [request] = server.requests
+        return request.url.params.get("query"), request.read()
+
+    def test_default_tsv(self):
+        query, body = self._insert([MockModel(a=1, b="x")])
+        self.assertIsNone(query)
+        self.assertEqual(body, b"INSERT INTO `test`.`mockmodel` (`a`,`b`) FORMAT TabSeparated\n1\tx\n")
+
+    def test_rowbinary(self):
+        for fmt in ("RowBinary", "auto"):
+            query, body = self._insert([MockModel(a=1, b="x"), MockModel(a=-1, b="")], format=fmt)
+            self.assertEqual(query, "INSERT INTO `test`.`mockmodel` (`a`,`b`) FORMAT RowBinary")
+            self.assertEqual(body, b"\x01\x00\x00\x00\x01x" + b"\xff\xff\xff\xff\x00")
+
+    def test_rowbinary_falls_back_to_tsv(self):
+        # The field's column type differs from the class its encoding comes from
+        query, body = self._insert([BigIdModel(a=1, b="x")], format="RowBinary")
+        self.assertIsNone(query)
+        self.assertEqual(body, b"INSERT INTO `test`.`bigidmodel` (`a`,`b`) FORMAT TabSeparated\n1\tx\n")
+
+    def test_explicit_format(self):
+        query, body = self._insert([MockModel(a=1, b="x")], format="TabSeparated")
+        self.assertIsNone(query)
+        self.assertTrue(body.endswith(b"FORMAT TabSeparated\n1\tx\n"))
+        with self.assertRaises(ValueError):
+            self._insert([MockModel(a=1, b="x")], format="CSV")
+
+
+class CompressionTestCase(unittest.IsolatedAsyncioTestCase):
+
+    methods = ("gzip", "deflate", "lz4", "zstd")
+
+    def _skip_unless_available(self, method):
+        module = {"lz4": "lz4.frame", "zstd": "zstandard"}.get(method)
+        if module:
+            try:
+                __import__(module)
+            except ImportError:
+                self.skipTest("%s is not installed" % module)
+
+    def _check_compressed(self, server, method):
+        request = server.requests[-1]
+        self.assertEqual(request.url.params.get("enable_http_compression"), "1")
+        self.assertEqual(request.headers.get("accept-encoding"), method)
+
+    def test_select(self):
+        for method in self.methods:
+            with self.subTest(method=method):
+                self._skip_unless_available(method)
+                server = MockServer()
+                db = server.database(compression=method)
+                results = list(db.select("SELECT * FROM $table", MockModel))
+                self.assertEqual([(m.a, m.b) for m in results], [(1, "x"), (2, "y")])
+                self._check_compressed(server, method)
+
+    def test_raw_stream(self):
+        for method in self.methods:
+            with self.subTest(method=method):
+                self._skip_unless_available(method)
+                server = MockServer()
+                db = server.database(compression=method)
+                query = "SELECT * FROM $db.x FORMAT TabSeparatedWithNames"
+                self.assertEqual(db.raw(query, stream=True), "a\tb\n1\tx\n2\ty\n")
+                self._check_compressed(server, method)
+                # Results that aren't streamed are not compressed
+                self.assertEqual(db.raw(query), "a\tb\n1\tx\n2\ty\n")
+                self.assertIsNone(server.requests[-1].url.params.get("enable_http_compression"))
+
+    async def test_aio(self):
+        for method in self.methods:
+            with self.subTest(method=method):
+                self._skip_unless_available(method)
+                server = MockServer()
+                db = server.aio_database(compression=method)
+                await db.init()
+                results = [m async for m in db.select("SELECT * FROM $table", MockModel)]
+                self.assertEqual([(m.a, m.b) for m in results], [(1, "x"), (2, "y")])
+                self._check_compressed(server, method)
+                query = "SELECT * FROM $db.x FORMAT TabSeparatedWithNames"
+                self.assertEqual(await db.raw(query, stream=True), "a\tb\n1\tx\n2\ty\n")
+                self._check_compressed(server, method)
+
+    def test_uncompressed(self):
+        server = MockServer()
+        db = server.database()
+        self.assertEqual(len(list(db.select("SELECT * FROM $table", MockModel))), 2)
+        self.assertIsNone(server.requests[-1].url.params.get("enable_http_compression"))
+
+    def test_unsupported_method(self):
+        with self.assertRaises(ValueError):
+            MockServer().database(compression="brotli")
+
+
+class InsertChunksTestCase(unittest.IsolatedAsyncioTestCase):
+
+    header = b"INSERT INTO `test`.`mockmodel` (`a`,`b`) FORMAT TabSeparated\n"
+
+    def _capture_chunks(self, db):
+        # Collects the chunks of the generated request body, then sends it whole
+        chunks = []
+        send = db._send
+
+        def capture(data, *args, **kwargs):
+            if inspect.isasyncgen(data):
+                async def collect():
+                    chunks.extend([chunk async for chunk in data])
+                    return await send(b"".join(chunks), *args, **kwargs)
+
+                return collect()
+            if not isinstance(data, (str, bytes)):
+                chunks.extend(data)
+                data = b"".join(chunks)
+            return send(data, *args, **kwargs)
+
+        db._send = capture
+        return chunks
+
+    def _instances(self):
+        return [MockModel(a=i, b="row %d" % i) for i in range(100)]
+
+    def _check_rows(self, chunks, max_rows, max_bytes):
+        body = b"".join(chunks)
+        self.assertTrue(body.startswith(self.header))
+        rows = body[len(self.header) :].decode().splitlines()
+        self.assertEqual(rows, ["%d\trow %d" % (i, i) for i in range(100)])
+        for chunk in chunks:
+            self.assertLessEqual(chunk.count(b"\n"), max_rows)
+            self.assertLessEqual(len(chunk), max_bytes)
+
+    def test_flush_bytes(self):
+        db = MockServer().database()
+        chunks = self._capture_chunks(db)
+        db.insert(self._instances(), flush_bytes=64, format="TabSeparated")
+        self.assertGreater(len(chunks), 10)
+        # A chunk is sent as soon as it reaches flush_bytes, so it exceeds it by one row at most
+        self._check_rows(chunks, 1000, len(self.header) + 64 + 10)
+
+    def test_batch_size_with_flush_bytes(self):
+        db = MockServer().database()
+        chunks = self._capture_chunks(db)
+        db.insert(self._instances(), batch_size=10, flush_bytes=1024 * 1024, format="TabSeparated")
+        self.assertGreaterEqual(len(chunks), 10)
+        self._check_rows(chunks, 10, 1024 * 1024)
+
+    async def test_aio_flush_bytes(self):
+        db = MockServer().aio_database()
+        await db.init()
+        chunks = self._capture_chunks(db)
+        await db.insert(self._instances(), flush_bytes=64, format="TabSeparated")
+        self.assertGreater(len(chunks), 10)
+        self._check_rows(chunks, 1000, len(self.header) + 64 + 10)
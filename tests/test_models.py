@@ -1,8 +1,9 @@
 import unittest
 import datetime
+import itertools
 import pytz
 
-from clickhouse_orm.models import Model, NO_VALUE
+from clickhouse_orm.models import Model, ModelBase, NO_VALUE
 from clickhouse_orm.fields import *
 from clickhouse_orm.engines import *
 from clickhouse_orm.funcs import F
@@ -103,6 +104,104 @@ class ModelTestCase(unittest.TestCase):
             str(cm.exception)
         )
 
+    def test_from_tsv_batch(self):
+        field_names = ['date_field', 'str_field', 'int_field']
+        lines = ['2021-03-04\ttab\\there\t%d\n' % i for i in range(10)]
+        instances = list(SimpleModel.from_tsv_batch(lines, field_names, chunk_size=3))
+        self.assertEqual(len(instances), 10)
+        for i, instance in enumerate(instances):
+            self.assertEqual(instance.date_field, datetime.date(2021, 3, 4))
+            self.assertEqual(instance.str_field, 'tab\there')
+            self.assertEqual(instance.int_field, i)
+            # Fields missing from the data get their defaults
+            self.assertEqual(instance.float_field, 0)
+            self.assertEqual(instance.default_func, NO_VALUE)
+            # Same result as converting each line separately
+            self.assertEqual(instance.to_dict(), SimpleModel.from_tsv(lines[i], field_names).to_dict())
+
+    def test_from_tsv_batch_malformed_lines(self):
+        field_names = ['str_field', 'int_field', 'float_field']
+        for bad_line in ['', 'y\t3', 'y\t3\t4\t5']:
+            lines = ['x\t1\t2', bad_line, 'z\t3\t4']
+            with self.assertRaises(ValueError):
+                list(SimpleModel.from_tsv_batch(lines, field_names))
+        # Rows in chunks before the malformed line are still returned
+        instances = SimpleModel.from_tsv_batch(['x\t1\t2', 'y\t3\t4', ''], field_names, chunk_size=2)
+        self.assertEqual([i.int_field for i in itertools.islice(instances, 2)], [1, 3])
+        with self.assertRaises(ValueError):
+            next(instances)
+
+    def test_compile_to_db_string(self):
+        class TsvModel(Model):
+            date_field = DateField()
+            str_field = StringField()
+            int_field = Int32Field()
+            arr_field = ArrayField(StringField())
+            null_field = NullableField(Float32Field())
+            alias_field = Float32Field(alias='null_field')
+        instances = [
+            TsvModel(),
+            TsvModel(date_field='2021-03-04', str_field="it's\ta\n'test'", int_field=-3,
+                     arr_field=['x', 'y\tz'], null_field=1.5),
+        ]
+        to_db_string = ModelBase.compile_to_db_string(TsvModel)
+        self.assertIs(ModelBase.compile_to_db_string(TsvModel), to_db_string)
+        for instance in instances:
+            self.assertEqual(to_db_string(instance), instance.to_db_string())
+        # Models using TSKV are not compiled
+        self.assertIs(ModelBase.compile_to_db_string(SimpleModel), SimpleModel.to_db_string)
+
+    def test_compile_to_rowbinary(self):
+        class BinaryModel(Model):
+            date_field = DateField()
+            datetime_field = DateTimeField()
+            str_field = StringField()
+            fixed_field = FixedStringField(4)
+            int_field = Int16Field()
+            float_field = Float64Field()
+            alias_field = Float64Field(alias='float_field')
+        instance = BinaryModel(date_field='1970-01-03', datetime_field=256, str_field='x' * 200,
+                               fixed_field='ab', int_field=-2, float_field=0.5)
+        expected = (b'\x02\x00' + b'\x00\x01\x00\x00' + b'\xc8\x01' + b'x' * 200 + b'ab\x00\x00'
+                    + b'\xfe\xff' + b'\x00\x00\x00\x00\x00\x00\xe0\x3f')
+        self.assertEqual(instance.to_rowbinary(), expected)
+        to_rowbinary = ModelBase.compile_to_rowbinary(BinaryModel)
+        self.assertIs(ModelBase.compile_to_rowbinary(BinaryModel), to_rowbinary)
+        self.assertEqual(to_rowbinary(instance), expected)
+        # Models with fields that don't support RowBinary, or using TSKV, are not compiled
+        class NullableModel(Model):
+            null_field = NullableField(Float32Field())
+        self.assertIsNone(ModelBase.compile_to_rowbinary(NullableModel))
+        self.assertIsNone(ModelBase.compile_to_rowbinary(SimpleModel))
+
+    def test_rowbinary_out_of_range(self):
+        self.assertEqual(Float32Field().to_rowbinary(1e40), b'\x00\x00\x80\x7f')
+        self.assertEqual(Float32Field().to_rowbinary(-1e40), b'\x00\x00\x80\xff')
+        field = DateTimeField()
+        for value in (-1, 2**32):
+            with self.assertRaises(ValueError):
+                field.to_rowbinary(field.to_python(value, pytz.utc))
+
+    def test_rowbinary_support_follows_db_type(self):
+        # Subclasses that change the column type don't inherit the binary encoding
+        class BigIdField(Int32Field):
+            db_type = 'Int64'
+        class UUIDStringField(StringField):
+            db_type = 'UUID'
+        class CustomIntField(Int32Field):
+            pass
+        self.assertTrue(CustomIntField().has_rowbinary_support())
+        self.assertFalse(BigIdField().has_rowbinary_support())
+        self.assertFalse(UUIDStringField().has_rowbinary_support())
+        self.assertFalse(DateTime64Field().has_rowbinary_support())
+        class BigIdModel(Model):
+            id = BigIdField()
+            name = StringField()
+        class UUIDModel(Model):
+            uuid = UUIDStringField()
+        self.assertIsNone(ModelBase.compile_to_rowbinary(BigIdModel))
+        self.assertIsNone(ModelBase.compile_to_rowbinary(UUIDModel))
+
 
 class SimpleModel(Model):
 
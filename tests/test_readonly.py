@@ -63,8 +63,9 @@ class ReadonlyTestCase(TestCaseWithData):
         self.database.drop_table(ReadOnlyModel)
 
     def test_nonexisting_readonly_database(self):
+        db = Database('dummy', readonly=True)
         with self.assertRaises(DatabaseException) as cm:
-            db = Database('dummy', readonly=True)
+            db.init()
         self.assertEqual(str(cm.exception), 'Database does not exist, and cannot be created under readonly connection')
 
 
@@ -29,3 +29,15 @@ class ServerErrorTest(unittest.TestCase):
         code, msg = ServerError.get_error_code_msg("Code: 60, e.displayText() = DB::Exception: Table default.zuzu doesn't exist.\n")
         self.assertEqual(code, 60)
         self.assertEqual(msg, "Table default.zuzu doesn't exist.")
+
+    def test_v21_format(self):
+
+        code, msg = ServerError.get_error_code_msg("Code: 60. DB::Exception: Table default.zuzu doesn't exist. (UNKNOWN_TABLE) (version 21.8.4.51 (official build))\n")
+        self.assertEqual(code, 60)
+        self.assertEqual(msg, "Table default.zuzu doesn't exist. (UNKNOWN_TABLE) (version 21.8.4.51 (official build))")
+
+    def test_unknown_format(self):
+
+        code, msg = ServerError.get_error_code_msg("Something went wrong")
+        self.assertEqual(code, 0)
+        self.assertEqual(msg, "Something went wrong")
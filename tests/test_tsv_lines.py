@@ -0,0 +1,38 @@
+import asyncio
+import unittest
+
+from clickhouse_orm.utils import iter_tsv_lines, aiter_tsv_lines
+
+
+def chunked(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+class TsvLinesTestCase(unittest.TestCase):
+
+    data = "a\tb\nשלום\t\\N\n\n" + "x" * 1000 + "\nlast"
+
+    def _aiter(self, chunks):
+        async def gen():
+            for chunk in chunks:
+                yield chunk
+
+        async def collect():
+            return [line async for line in aiter_tsv_lines(gen())]
+
+        return asyncio.run(collect())
+
+    def test_chunk_sizes(self):
+        expected = self.data.split("\n")
+        data = self.data.encode("utf-8")
+        # Includes chunks that split multibyte characters, and chunks without any newline
+        for size in (1, 2, 3, 7, 64, len(data)):
+            chunks = chunked(data, size)
+            self.assertEqual(list(iter_tsv_lines(chunks)), expected)
+            self.assertEqual(self._aiter(chunks), expected)
+
+    def test_trailing_newline(self):
+        chunks = [b"a\n", b"b\n"]
+        self.assertEqual(list(iter_tsv_lines(chunks)), ["a", "b"])
+        self.assertEqual(self._aiter(chunks), ["a", "b"])
+        self.assertEqual(list(iter_tsv_lines([])), [])